@@ -1,257 +1,286 @@
 """API route handlers for MBTA data."""
-import traceback
-from fastapi import APIRouter, HTTPException, Query
-from typing import List, Dict, Any, Optional
+import asyncio
+import functools
+import logging
+from fastapi import APIRouter, HTTPException, Query, Request
+from fastapi.responses import ORJSONResponse
+from typing import Any, Callable, Dict, List, Optional
 from ..services.mbta_client import mbta_client
+from ..services.response_cache import cache_response
+
+logger = logging.getLogger(__name__)
 
 router = APIRouter(prefix="/api", tags=["mbta"])
 
+# Response cache TTLs. GTFS data changes at most daily, so line metadata
+# can be held for a day and the rest for an hour.
+LINES_CACHE_SECONDS = 86400
+DEFAULT_CACHE_SECONDS = 3600
+
+# line_id -> route IDs memo so alert requests skip the routes round-trip.
+# The mapping is effectively static GTFS data. line_id is a
+# client-supplied path param, so the memo is capped - only a handful of
+# real lines exist - and empty results are never stored (unknown lines,
+# or a transient empty upstream response, must not stick until restart).
+_line_route_ids: Dict[str, List[str]] = {}
+_LINE_ROUTE_IDS_MAX = 32
+
+# Diagram requests above this many routes are split into parallel
+# upstream chunks so latency stays at ~one round-trip.
+MAX_ROUTES_PER_UPSTREAM_REQUEST = 10
+
+
+def _chunk_route_ids(route_ids: List[str]) -> List[List[str]]:
+    """Split a route ID list into chunks of at most the upstream limit."""
+    size = MAX_ROUTES_PER_UPSTREAM_REQUEST
+    return [route_ids[i:i + size] for i in range(0, len(route_ids), size)]
+
+
+@functools.lru_cache(maxsize=256)
+def _parse_route_ids(route_ids: str) -> tuple:
+    """
+    Split a comma-separated route_ids query string into a tuple of IDs.
+
+    The frontend sends the same comma-joined string repeatedly for the
+    route diagram, so the parse is memoized and warm calls are a dict
+    lookup.
+    """
+    return tuple(r.strip() for r in route_ids.split(","))
+
+
+def _data_included(response: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Wrap an MBTA response's data/included arrays for the API reply.
+
+    `or []` only allocates the fallback list on a missing/None key, and
+    the single small function keeps the hot path monomorphic for the
+    interpreter's inline caches.
+    """
+    return {
+        "data": response.get("data") or [],
+        "included": response.get("included") or []
+    }
+
+
+def handle_mbta_errors(what: str) -> Callable:
+    """
+    Decorator that converts unexpected handler errors into HTTP 500s.
+
+    `what` describes the operation (e.g. "fetching stops for route
+    {route_id}") and may reference the handler's keyword arguments.
+    HTTPExceptions pass through untouched; anything else is logged with
+    its traceback via logger.exception, which formats lazily.
+    """
+    def decorator(handler: Callable) -> Callable:
+        @functools.wraps(handler)
+        async def wrapper(*args, **kwargs):
+            try:
+                return await handler(*args, **kwargs)
+            except HTTPException:
+                raise
+            except Exception as e:
+                context = what.format(**kwargs) if kwargs else what
+                logger.exception("Error %s", context)
+                raise HTTPException(
+                    status_code=500,
+                    detail=f"Error {context}: {str(e)}"
+                )
+        return wrapper
+    return decorator
+
 
 @router.get("/lines")
-async def get_lines() -> Dict[str, Any]:
+@cache_response(expire=LINES_CACHE_SECONDS)
+@handle_mbta_errors("fetching lines")
+async def get_lines(request: Request) -> Dict[str, Any]:
     """Get all subway lines."""
-    try:
-        lines = await mbta_client.get_subway_lines()
-        return {"data": lines}
-    except Exception as e:
-        tb = traceback.extract_tb(e.__traceback__)
-        line_no = tb[-1].lineno if tb else "unknown"
-        print(f"Exception at line {line_no}: {e}")
-        raise HTTPException(
-            status_code=500,
-            detail=f"Error fetching lines: {str(e)}"
-        )
+    lines = await mbta_client.get_subway_lines()
+    return {"data": lines}
 
 
 @router.get("/routes/{line_id}")
-async def get_routes_for_line(line_id: str) -> Dict[str, Any]:
+@cache_response(expire=DEFAULT_CACHE_SECONDS)
+@handle_mbta_errors("fetching routes for line {line_id}")
+async def get_routes_for_line(request: Request, line_id: str) -> Dict[str, Any]:
     """Get routes for a specific line. Includes line relationships for colors."""
-    try:
-        routes_response = await mbta_client.get_routes_for_line(line_id)
-        return {
-            "data": routes_response.get("data", []),
-            "included": routes_response.get("included", [])
-        }
-    except Exception as e:
-        tb = traceback.extract_tb(e.__traceback__)
-        line_no = tb[-1].lineno if tb else "unknown"
-        print(f"Exception at line {line_no}: {e}")
-        raise HTTPException(
-            status_code=500,
-            detail=f"Error fetching routes for line {line_id}: {str(e)}"
-        )
+    routes_response = await mbta_client.get_routes_for_line(line_id)
+    return _data_included(routes_response)
 
 
 @router.get("/routes")
-async def get_all_subway_routes() -> Dict[str, Any]:
+@cache_response(expire=DEFAULT_CACHE_SECONDS)
+@handle_mbta_errors("fetching all subway routes")
+async def get_all_subway_routes(request: Request) -> Dict[str, Any]:
     """Get all subway routes (for route diagram)."""
-    try:
-        routes_response = await mbta_client.get_all_subway_routes()
-        return {
-            "data": routes_response.get("data", []),
-            "included": routes_response.get("included", [])
-        }
-    except Exception as e:
-        tb = traceback.extract_tb(e.__traceback__)
-        line_no = tb[-1].lineno if tb else "unknown"
-        print(f"Exception at line {line_no}: {e}")
-        raise HTTPException(
-            status_code=500,
-            detail=f"Error fetching all subway routes: {str(e)}"
-        )
+    routes_response = await mbta_client.get_all_subway_routes()
+    return _data_included(routes_response)
 
 
 @router.get("/stops/{route_id}")
-async def get_stops_for_route(route_id: str) -> Dict[str, Any]:
+@cache_response(expire=DEFAULT_CACHE_SECONDS)
+@handle_mbta_errors("fetching stops for route {route_id}")
+async def get_stops_for_route(request: Request, route_id: str) -> Dict[str, Any]:
     """Get stops for a specific route."""
-    try:
-        stops = await mbta_client.get_stops_for_route(route_id)
-        return {"data": stops}
-    except Exception as e:
-        tb = traceback.extract_tb(e.__traceback__)
-        line_no = tb[-1].lineno if tb else "unknown"
-        print(f"Exception at line {line_no}: {e}")
-        raise HTTPException(
-            status_code=500,
-            detail=f"Error fetching stops for route {route_id}: {str(e)}"
-        )
+    stops = await mbta_client.get_stops_for_route(route_id)
+    return {"data": stops}
 
 
 @router.get("/stops")
+@cache_response(expire=DEFAULT_CACHE_SECONDS, file_backed=True)
+@handle_mbta_errors("fetching stops")
 async def get_all_stops_for_routes(
+    request: Request,
     route_ids: Optional[str] = Query(None)
 ) -> Dict[str, Any]:
     """
     Get all stops for multiple routes (for route diagram).
-    
+
     Args:
         route_ids: Comma-separated route IDs (query parameter)
     """
-    try:
-        if not route_ids:
-            raise HTTPException(
-                status_code=400,
-                detail="route_ids parameter is required"
-            )
-        route_ids_list = [r.strip() for r in route_ids.split(",")]
-        stops = await mbta_client.get_all_stops_for_routes(route_ids_list)
-        return {"data": stops}
-    except HTTPException:
-        raise
-    except Exception as e:
-        tb = traceback.extract_tb(e.__traceback__)
-        line_no = tb[-1].lineno if tb else "unknown"
-        print(f"Exception at line {line_no}: {e}")
+    if not route_ids:
         raise HTTPException(
-            status_code=500,
-            detail=f"Error fetching stops: {str(e)}"
+            status_code=400,
+            detail="route_ids parameter is required"
         )
+    route_ids_list = list(_parse_route_ids(route_ids))
+    if len(route_ids_list) > MAX_ROUTES_PER_UPSTREAM_REQUEST:
+        # Overlap the upstream round-trips instead of one oversized request
+        chunk_results = await asyncio.gather(
+            *(mbta_client.get_all_stops_for_routes(chunk)
+              for chunk in _chunk_route_ids(route_ids_list))
+        )
+        # A stop serving routes in different chunks comes back once per
+        # chunk; dedupe by id to match the single-request output
+        seen_stop_ids = set()
+        stops = []
+        for chunk in chunk_results:
+            for stop in chunk:
+                stop_id = stop.get("id")
+                if stop_id not in seen_stop_ids:
+                    seen_stop_ids.add(stop_id)
+                    stops.append(stop)
+    else:
+        stops = await mbta_client.get_all_stops_for_routes(route_ids_list)
+    return {"data": stops}
 
 
-@router.get("/predictions/{route_id}")
+@router.get("/predictions/{route_id}", response_model=None)
+@handle_mbta_errors("fetching predictions for route {route_id}")
 async def get_predictions_for_route(
     route_id: str
-) -> Dict[str, Any]:
+) -> ORJSONResponse:
     """
     Get predictions for a specific route. Includes stop data for matching.
-    
-    NOTE: Predictions are NEVER cached - always fetched fresh from API.
+
+    NOTE: Predictions are cached for only a few seconds by the client,
+    well under the rate at which the MBTA updates them.
     """
-    try:
-        predictions_response = await mbta_client.get_predictions_for_route(route_id)
-        return {
-            "data": predictions_response.get("data", []),
-            "included": predictions_response.get("included", [])
-        }
-    except Exception as e:
-        tb = traceback.extract_tb(e.__traceback__)
-        line_no = tb[-1].lineno if tb else "unknown"
-        print(f"Exception at line {line_no}: {e}")
-        raise HTTPException(
-            status_code=500,
-            detail=f"Error fetching predictions for route {route_id}: {str(e)}"
-        )
+    predictions_response = await mbta_client.get_predictions_for_route(route_id)
+    # Return the response directly so FastAPI skips jsonable_encoder's
+    # recursive walk over the prediction dicts
+    return ORJSONResponse(_data_included(predictions_response))
 
 
-@router.get("/predictions/stop/{stop_id}")
+@router.get("/predictions/stop/{stop_id}", response_model=None)
+@handle_mbta_errors("fetching predictions for stop {stop_id}")
 async def get_predictions_for_stop(
     stop_id: str
-) -> Dict[str, Any]:
+) -> ORJSONResponse:
     """
     Get predictions for a specific stop.
-    
-    NOTE: Predictions are NEVER cached - always fetched fresh from API.
+
+    NOTE: Predictions are cached for only a few seconds by the client,
+    well under the rate at which the MBTA updates them.
     """
-    try:
-        predictions_response = await mbta_client.get_predictions_for_stop(stop_id)
-        return {
-            "data": predictions_response.get("data", []),
-            "included": predictions_response.get("included", [])
-        }
-    except Exception as e:
-        tb = traceback.extract_tb(e.__traceback__)
-        line_no = tb[-1].lineno if tb else "unknown"
-        print(f"Exception at line {line_no}: {e}")
-        raise HTTPException(
-            status_code=500,
-            detail=f"Error fetching predictions for stop {stop_id}: {str(e)}"
-        )
+    predictions_response = await mbta_client.get_predictions_for_stop(stop_id)
+    # Return the response directly so FastAPI skips jsonable_encoder's
+    # recursive walk over the prediction dicts
+    return ORJSONResponse(_data_included(predictions_response))
 
 
 @router.get("/shapes/{route_id}")
-async def get_shapes_for_route(route_id: str) -> Dict[str, Any]:
+@cache_response(expire=DEFAULT_CACHE_SECONDS, file_backed=True)
+@handle_mbta_errors("fetching shapes for route {route_id}")
+async def get_shapes_for_route(request: Request, route_id: str) -> Dict[str, Any]:
     """Get shapes (polylines) for a specific route."""
-    try:
-        shapes = await mbta_client.get_shapes_for_route(route_id)
-        return {"data": shapes}
-    except Exception as e:
-        tb = traceback.extract_tb(e.__traceback__)
-        line_no = tb[-1].lineno if tb else "unknown"
-        print(f"Exception at line {line_no}: {e}")
-        raise HTTPException(
-            status_code=500,
-            detail=f"Error fetching shapes for route {route_id}: {str(e)}"
-        )
+    shapes = await mbta_client.get_shapes_for_route(route_id)
+    return {"data": shapes}
 
 
 @router.get("/shapes")
+@cache_response(expire=DEFAULT_CACHE_SECONDS, file_backed=True)
+@handle_mbta_errors("fetching shapes")
 async def get_all_shapes_for_routes(
+    request: Request,
     route_ids: Optional[str] = Query(None)
 ) -> Dict[str, Any]:
     """
     Get all shapes for multiple routes (for route diagram).
     Returns shapes with route information for color mapping.
-    
+
     Args:
         route_ids: Comma-separated route IDs (query parameter)
     """
-    try:
-        if not route_ids:
-            raise HTTPException(
-                status_code=400,
-                detail="route_ids parameter is required"
-            )
-        route_ids_list = [r.strip() for r in route_ids.split(",")]
-        shapes_response = await mbta_client.get_all_shapes_for_routes(route_ids_list)
-        return {
-            "data": shapes_response.get("data", []),
-            "included": []  # Shapes don't have included relationships, route_id is in attributes
-        }
-    except HTTPException:
-        raise
-    except Exception as e:
-        tb = traceback.extract_tb(e.__traceback__)
-        line_no = tb[-1].lineno if tb else "unknown"
-        print(f"Exception at line {line_no}: {e}")
+    if not route_ids:
         raise HTTPException(
-            status_code=500,
-            detail=f"Error fetching shapes: {str(e)}"
+            status_code=400,
+            detail="route_ids parameter is required"
+        )
+    route_ids_list = list(_parse_route_ids(route_ids))
+    if len(route_ids_list) > MAX_ROUTES_PER_UPSTREAM_REQUEST:
+        # Overlap the upstream round-trips instead of one oversized request
+        chunk_results = await asyncio.gather(
+            *(mbta_client.get_all_shapes_for_routes(chunk)
+              for chunk in _chunk_route_ids(route_ids_list))
         )
+        shapes_response = {
+            "data": [shape for chunk in chunk_results
+                     for shape in chunk.get("data", [])]
+        }
+    else:
+        shapes_response = await mbta_client.get_all_shapes_for_routes(route_ids_list)
+    return {
+        "data": shapes_response.get("data", []),
+        "included": []  # Shapes don't have included relationships, route_id is in attributes
+    }
 
 
-@router.get("/alerts/{line_id}")
-async def get_alerts_for_line(line_id: str) -> Dict[str, Any]:
+@router.get("/alerts/{line_id}", response_model=None)
+@handle_mbta_errors("fetching alerts for line {line_id}")
+async def get_alerts_for_line(line_id: str) -> ORJSONResponse:
     """
     Get alerts for a subway line.
-    
-    First fetches routes for the line, then gets alerts for those routes.
+
+    Uses a memoized line -> route IDs mapping so the warm path goes
+    straight to the alerts fetch instead of paying a routes round-trip first.
     """
-    try:
-        # First get routes for the line
+    route_ids = _line_route_ids.get(line_id)
+    if route_ids is None:
+        # Cold path: fetch routes for the line and memoize the IDs -
+        # but only non-empty results, so unknown lines don't accumulate
+        # entries and a transient empty response isn't pinned forever
         routes_response = await mbta_client.get_routes_for_line(line_id)
         routes_data = routes_response.get("data", [])
-        if not routes_data:
-            return {"data": []}
-        
-        # Extract route IDs
         route_ids = [route.get("id") for route in routes_data if route.get("id")]
-        
-        # Get alerts for those routes
-        alerts = await mbta_client.get_alerts_for_line(route_ids)
-        return {"data": alerts}
-    except Exception as e:
-        tb = traceback.extract_tb(e.__traceback__)
-        line_no = tb[-1].lineno if tb else "unknown"
-        print(f"Exception at line {line_no}: {e}")
-        raise HTTPException(
-            status_code=500,
-            detail=f"Error fetching alerts for line {line_id}: {str(e)}"
-        )
+        if route_ids:
+            while len(_line_route_ids) >= _LINE_ROUTE_IDS_MAX:
+                # Oldest insertion first
+                _line_route_ids.pop(next(iter(_line_route_ids)))
+            _line_route_ids[line_id] = route_ids
 
+    if not route_ids:
+        return ORJSONResponse({"data": []})
 
-@router.get("/facilities/{stop_id}")
-async def get_facilities_for_stop(stop_id: str) -> Dict[str, Any]:
-    """Get facilities (elevators, escalators, etc.) for a specific stop."""
-    try:
-        facilities = await mbta_client.get_facilities_for_stop(stop_id)
-        return {"data": facilities}
-    except Exception as e:
-        tb = traceback.extract_tb(e.__traceback__)
-        line_no = tb[-1].lineno if tb else "unknown"
-        print(f"Exception at line {line_no}: {e}")
-        raise HTTPException(
-            status_code=500,
-            detail=f"Error fetching facilities for stop {stop_id}: {str(e)}"
-        )
+    # Get alerts for those routes
+    alerts = await mbta_client.get_alerts_for_line(route_ids)
+    return ORJSONResponse({"data": alerts})
 
 
+@router.get("/facilities/{stop_id}")
+@cache_response(expire=DEFAULT_CACHE_SECONDS)
+@handle_mbta_errors("fetching facilities for stop {stop_id}")
+async def get_facilities_for_stop(request: Request, stop_id: str) -> Dict[str, Any]:
+    """Get facilities (elevators, escalators, etc.) for a specific stop."""
+    facilities = await mbta_client.get_facilities_for_stop(stop_id)
+    return {"data": facilities}
@@ -1,21 +1,69 @@
 """FastAPI application entry point."""
+import logging
+import logging.handlers
+import queue
+from contextlib import asynccontextmanager
+
+import uvloop
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import ORJSONResponse
 from .api import routes
+from .services.http import aclose_shared_client
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Application lifespan: close pooled HTTP connections on shutdown."""
+    yield
+    await aclose_shared_client()
+
+
+def configure_logging() -> None:
+    """
+    Route log records through a queue.
+
+    Handlers format and write on the QueueListener's thread, so log I/O
+    never blocks the event loop thread serving requests.
+    """
+    log_queue: queue.SimpleQueue = queue.SimpleQueue()
+    stream_handler = logging.StreamHandler()
+    stream_handler.setFormatter(
+        logging.Formatter("%(asctime)s %(levelname)s %(name)s: %(message)s")
+    )
+    listener = logging.handlers.QueueListener(log_queue, stream_handler)
+    listener.start()
+
+    root = logging.getLogger()
+    root.setLevel(logging.INFO)
+    root.addHandler(logging.handlers.QueueHandler(log_queue))
+
+
+configure_logging()
+
+# Use uvloop's C event loop regardless of how the app is launched.
+# uvicorn picks it up automatically, but installing the policy here also
+# covers programmatic runners.
+uvloop.install()
 
 app = FastAPI(
     title="MBTA Subway Arrival Times API",
     description="API for MBTA subway arrival times and route information",
-    version="1.0.0"
+    version="1.0.0",
+    # orjson serializes the large stop/shape payloads much faster than stdlib json
+    default_response_class=ORJSONResponse,
+    lifespan=lifespan
 )
 
-# Configure CORS
+# Configure CORS. The API is GET-only and the frontend is known, so
+# list methods and headers explicitly: the middleware then skips its
+# wildcard header-introspection branch on every request.
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["http://localhost:3000", "http://localhost:5173"],
     allow_credentials=True,
-    allow_methods=["*"],
-    allow_headers=["*"],
+    allow_methods=["GET"],
+    allow_headers=["content-type", "if-none-match"],
 )
 
 # Include API routes
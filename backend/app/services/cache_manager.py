@@ -2,17 +2,30 @@
 Cache manager for MBTA data.
 Saves and loads cached data from files in the Data folder.
 """
-import json
+import functools
+import gzip
+import logging
 import os
-import traceback
+import aiofiles
+import orjson
 from pathlib import Path
-from typing import Any, Dict, Optional
-from datetime import datetime, timedelta
+from typing import Any, Dict, Optional, Tuple
+from datetime import datetime
+
+logger = logging.getLogger(__name__)
 
 # Cache directory (in project root)
 CACHE_DIR = Path(__file__).parent.parent.parent / "Data"
 CACHE_EXPIRY_HOURS = 168  # Cache expires after 7 days (1 week)
 
+# Expiry times (epoch seconds) memoized per cache file, so validity checks
+# on hot entries are a dict lookup instead of a stat() syscall
+_expiry_cache: Dict[str, float] = {}
+
+# In-memory tier in front of the disk files: only the first hit per
+# process parses JSON, later hits return the already-parsed object
+_mem_cache: Dict[str, Any] = {}
+
 
 def ensure_cache_dir() -> Path:
     """Ensure the cache directory exists."""
@@ -20,81 +33,170 @@ def ensure_cache_dir() -> Path:
     return CACHE_DIR
 
 
+# Create the cache directory once at import instead of re-issuing the
+# mkdir syscall on every path lookup
+ensure_cache_dir()
+
+
+@functools.lru_cache(maxsize=1024)
 def get_cache_file_path(cache_key: str) -> Path:
-    """Get the full path to a cache file."""
-    ensure_cache_dir()
-    return CACHE_DIR / f"{cache_key}.json"
+    """Get the full path to a cache file. Paths are memoized per key."""
+    return CACHE_DIR / f"{cache_key}.json.gz"
 
 
 def is_cache_valid(cache_file: Path) -> bool:
     """Check if cache file exists and is not expired."""
+    # Fast path: expiry already known for this file
+    cached_expiry = _expiry_cache.get(str(cache_file))
+    if cached_expiry is not None and datetime.now().timestamp() < cached_expiry:
+        return True
+
     if not cache_file.exists():
         return False
-    
-    # Check file modification time
-    file_time = datetime.fromtimestamp(cache_file.stat().st_mtime)
-    age = datetime.now() - file_time
-    
-    return age < timedelta(hours=CACHE_EXPIRY_HOURS)
+
+    # Check file modification time and memoize the resulting expiry
+    expiry = cache_file.stat().st_mtime + CACHE_EXPIRY_HOURS * 3600
+    _expiry_cache[str(cache_file)] = expiry
+
+    return datetime.now().timestamp() < expiry
+
+
+def _unwrap(entry: Any) -> Tuple[Any, Optional[str]]:
+    """
+    Split a cache entry into (data, etag).
+
+    Entries written with an upstream ETag are {"etag": ..., "data": ...}
+    wrappers; anything else (including files from before the wrapper
+    existed) is treated as bare data with no ETag.
+    """
+    if isinstance(entry, dict) and set(entry) == {"etag", "data"}:
+        return entry["data"], entry["etag"]
+    return entry, None
 
 
-def save_to_cache(cache_key: str, data: Any) -> bool:
+async def save_to_cache(cache_key: str, data: Any, etag: Optional[str] = None) -> bool:
     """
     Save data to cache file.
-    
+
     Args:
         cache_key: Unique identifier for the cache entry
         data: Data to cache (must be JSON serializable)
-        
+        etag: Upstream ETag for the data, if the source sent one -
+            kept so refreshes can revalidate with If-None-Match
+
     Returns:
         True if successful, False otherwise
     """
     try:
         cache_file = get_cache_file_path(cache_key)
-        
-        cache_data = {
-            "timestamp": datetime.now().isoformat(),
-            "data": data
-        }
-        
-        with open(cache_file, 'w', encoding='utf-8') as f:
-            json.dump(cache_data, f, indent=2, ensure_ascii=False)
-        
+
+        # Expiry comes from the file mtime (see is_cache_valid), so no
+        # timestamp is stored - only the ETag wrapper when present.
+        # orjson is always UTF-8 and returns bytes, so write in binary mode.
+        # Level-1 gzip shrinks the JSON ~4-5x for very little CPU, so fewer
+        # bytes cross the filesystem on every load.
+        # aiofiles keeps the write off the event loop thread.
+        entry = {"etag": etag, "data": data} if etag else data
+        payload = gzip.compress(
+            orjson.dumps(entry, option=orjson.OPT_SERIALIZE_NUMPY),
+            compresslevel=1
+        )
+        async with aiofiles.open(cache_file, 'wb') as f:
+            await f.write(payload)
+
+        # Write through to the in-memory tier
+        _mem_cache[cache_key] = entry
+
+        # Fresh write - refresh the memoized expiry
+        _expiry_cache[str(cache_file)] = (
+            datetime.now().timestamp() + CACHE_EXPIRY_HOURS * 3600
+        )
+
         return True
-    except Exception as e:
-        tb = traceback.extract_tb(e.__traceback__)
-        line_no = tb[-1].lineno if tb else "unknown"
-        print(f"Exception at line {line_no}: Error saving cache for {cache_key}: {e}")
+    except Exception:
+        logger.exception("Error saving cache for %s", cache_key)
         return False
 
 
-def load_from_cache(cache_key: str) -> Optional[Any]:
+async def load_from_cache(cache_key: str) -> Optional[Any]:
     """
     Load data from cache file.
-    
+
     Args:
         cache_key: Unique identifier for the cache entry
-        
+
     Returns:
         Cached data if valid, None otherwise
     """
     try:
         cache_file = get_cache_file_path(cache_key)
-        
+
         if not is_cache_valid(cache_file):
             return None
-        
-        with open(cache_file, 'r', encoding='utf-8') as f:
-            cache_data = json.load(f)
-        
-        return cache_data.get("data")
-    except Exception as e:
-        tb = traceback.extract_tb(e.__traceback__)
-        line_no = tb[-1].lineno if tb else "unknown"
-        print(f"Exception at line {line_no}: Error loading cache for {cache_key}: {e}")
+
+        # Memory tier first: skip the disk read and JSON parse entirely
+        if cache_key in _mem_cache:
+            return _unwrap(_mem_cache[cache_key])[0]
+
+        # aiofiles keeps the read off the event loop thread
+        async with aiofiles.open(cache_file, 'rb') as f:
+            entry = orjson.loads(gzip.decompress(await f.read()))
+
+        _mem_cache[cache_key] = entry
+        return _unwrap(entry)[0]
+    except Exception:
+        logger.exception("Error loading cache for %s", cache_key)
         return None
 
 
+async def load_stale_from_cache(cache_key: str) -> Tuple[Optional[Any], Optional[str]]:
+    """
+    Load a cache entry even if it has expired.
+
+    Used for conditional refreshes: the stale data plus its ETag let the
+    caller ask upstream "has this changed?" and reuse the entry on a 304.
+
+    Args:
+        cache_key: Unique identifier for the cache entry
+
+    Returns:
+        Tuple of (data, etag); (None, None) if the entry doesn't exist
+    """
+    try:
+        if cache_key in _mem_cache:
+            return _unwrap(_mem_cache[cache_key])
+
+        cache_file = get_cache_file_path(cache_key)
+        if not cache_file.exists():
+            return None, None
+
+        async with aiofiles.open(cache_file, 'rb') as f:
+            entry = orjson.loads(gzip.decompress(await f.read()))
+
+        _mem_cache[cache_key] = entry
+        return _unwrap(entry)
+    except Exception:
+        logger.exception("Error loading stale cache for %s", cache_key)
+        return None, None
+
+
+def refresh_cache_entry(cache_key: str) -> None:
+    """
+    Renew an entry's expiry without rewriting it.
+
+    Called after upstream confirms the data is unchanged (a 304): the
+    file mtime is bumped so is_cache_valid treats the entry as fresh.
+    """
+    try:
+        cache_file = get_cache_file_path(cache_key)
+        os.utime(cache_file, None)
+        _expiry_cache[str(cache_file)] = (
+            datetime.now().timestamp() + CACHE_EXPIRY_HOURS * 3600
+        )
+    except Exception:
+        logger.exception("Error refreshing cache entry for %s", cache_key)
+
+
 def clear_cache(cache_key: Optional[str] = None) -> bool:
     """
     Clear cache file(s).
@@ -108,17 +210,20 @@ def clear_cache(cache_key: Optional[str] = None) -> bool:
     try:
         if cache_key:
             cache_file = get_cache_file_path(cache_key)
+            _expiry_cache.pop(str(cache_file), None)
+            _mem_cache.pop(cache_key, None)
             if cache_file.exists():
                 cache_file.unlink()
         else:
             # Clear all cache files
+            _expiry_cache.clear()
+            _mem_cache.clear()
             cache_dir = ensure_cache_dir()
-            for cache_file in cache_dir.glob("*.json"):
+            # Match both the current .json.gz format and any old .json files
+            for cache_file in cache_dir.glob("*.json*"):
                 cache_file.unlink()
-        
+
         return True
-    except Exception as e:
-        tb = traceback.extract_tb(e.__traceback__)
-        line_no = tb[-1].lineno if tb else "unknown"
-        print(f"Exception at line {line_no}: Error clearing cache: {e}")
+    except Exception:
+        logger.exception("Error clearing cache")
         return False
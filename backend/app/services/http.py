@@ -0,0 +1,41 @@
+"""
+Shared HTTP client for all outbound requests.
+
+One process-wide httpx.AsyncClient serves both the MBTA API and the
+tile servers: connections stay pooled across modules, HTTP/2 multiplexes
+concurrent requests to the same host over one TCP/TLS stream, and DNS
+lookups are amortized. The client is created lazily on first use (so the
+event loop exists) and closed from the FastAPI lifespan on shutdown.
+"""
+import asyncio
+from typing import Optional
+
+import httpx
+
+_client: Optional[httpx.AsyncClient] = None
+_client_lock = asyncio.Lock()
+
+
+async def get_shared_client() -> httpx.AsyncClient:
+    """Get the process-wide HTTP client, creating it on first use."""
+    global _client
+    if _client is None:
+        async with _client_lock:
+            if _client is None:
+                _client = httpx.AsyncClient(
+                    timeout=30.0,
+                    http2=True,
+                    limits=httpx.Limits(
+                        max_connections=100,
+                        max_keepalive_connections=50
+                    )
+                )
+    return _client
+
+
+async def aclose_shared_client() -> None:
+    """Close the shared client and its pooled connections."""
+    global _client
+    if _client is not None:
+        await _client.aclose()
+        _client = None
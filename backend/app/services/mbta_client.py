@@ -1,21 +1,90 @@
 """MBTA API client for fetching subway data."""
 import asyncio
+import logging
 import os
-import traceback
+import time
+from operator import itemgetter
+import numpy as np
+import orjson
+import polyline as polyline_codec
 from pathlib import Path
-from typing import Any, Dict, List, Optional
-import httpx
+from typing import Any, Dict, List, Optional, Tuple
 from dotenv import load_dotenv
-from .cache_manager import save_to_cache, load_from_cache
+from .cache_manager import (
+    save_to_cache,
+    load_from_cache,
+    load_stale_from_cache,
+    refresh_cache_entry,
+)
+from .http import get_shared_client
 
 # Load .env file from root directory (one level up from backend/app/services)
 root_dir = Path(__file__).parent.parent.parent.parent
 env_path = root_dir / ".env"
 load_dotenv(dotenv_path=env_path)
 
+logger = logging.getLogger(__name__)
+
 MBTA_API_BASE_URL = "https://api-v3.mbta.com"
 MBTA_API_KEY = os.getenv("MBTA_API_KEY")
 
+# Predictions update upstream on a ~10-30 second cadence, so reusing a
+# response for a few seconds is invisible to users but collapses the
+# per-client request fan-in under load
+PREDICTIONS_CACHE_SECONDS = float(os.getenv("MBTA_PREDICTIONS_TTL", "10"))
+
+# TTL cache for predictions: key -> (monotonic fetch time, response).
+# Keys come from client-supplied route/stop IDs, so the cache is capped
+# and expired entries (plus their locks) are pruned on every store.
+_predictions_cache: Dict[str, Tuple[float, Dict[str, Any]]] = {}
+PREDICTIONS_CACHE_MAX_ENTRIES = 256
+
+# Per-key locks so concurrent misses for the same route/stop coalesce
+# into a single upstream request instead of a thundering herd
+_predictions_locks: Dict[str, asyncio.Lock] = {}
+
+
+def _prune_predictions_cache(now: float) -> None:
+    """Drop expired entries and their locks, then enforce the size cap."""
+    expired = [
+        key for key, (fetched_at, _) in _predictions_cache.items()
+        if now - fetched_at >= PREDICTIONS_CACHE_SECONDS
+    ]
+    for key in expired:
+        _predictions_cache.pop(key, None)
+        _predictions_locks.pop(key, None)
+    # Dicts iterate in insertion order, so the first keys are the oldest
+    while len(_predictions_cache) >= PREDICTIONS_CACHE_MAX_ENTRIES:
+        key = next(iter(_predictions_cache))
+        _predictions_cache.pop(key, None)
+        _predictions_locks.pop(key, None)
+    # A fetch that raised leaves a lock with no cache entry; drop those
+    # once idle so failed keys don't leak locks
+    orphans = [
+        key for key, lock in _predictions_locks.items()
+        if key not in _predictions_cache and not lock.locked()
+    ]
+    for key in orphans:
+        _predictions_locks.pop(key, None)
+
+# Shared line relationship assigned to every remapped Mattapan route -
+# one constant instead of fresh identical dicts per route per call.
+# Treated as immutable.
+_RED_LINE_REL = {"data": {"id": "line-Red", "type": "line"}}
+
+
+def _line_id(route: Dict[str, Any]) -> Optional[str]:
+    """
+    Get the line ID from a route's line relationship.
+
+    Short-circuits on missing keys instead of chaining .get(..., {}),
+    which allocates an empty dict per miss at every level.
+    """
+    relationships = route.get("relationships")
+    line = relationships and relationships.get("line")
+    data = line and line.get("data")
+    return data and data.get("id")
+
 
 class MBTAClient:
     """Client for interacting with MBTA V3 API."""
@@ -27,7 +96,7 @@ class MBTAClient:
         self.headers = {}
         if self.api_key:
             self.headers["X-API-Key"] = self.api_key
-    
+
     async def _make_request(
             self,
             endpoint: str,
@@ -35,24 +104,60 @@ class MBTAClient:
     ) -> Dict[str, Any]:
         """
         Make an HTTP request to the MBTA API.
-        
+
         Args:
             endpoint: API endpoint path
             params: Query parameters
-            
+
         Returns:
             JSON response data
         """
-        url = f"{self.base_url}{endpoint}"
-        async with httpx.AsyncClient() as client:
-            response = await client.get(
-                url,
-                headers=self.headers,
-                params=params,
-                timeout=30.0
-            )
-            response.raise_for_status()
-            return response.json()
+        # All requests ride the process-wide pooled client (see
+        # services.http), so MBTA calls share connections - and HTTP/2
+        # streams - with every other outbound request
+        client = await get_shared_client()
+        response = await client.get(
+            f"{self.base_url}{endpoint}",
+            params=params,
+            headers=self.headers
+        )
+        response.raise_for_status()
+        # httpx has already buffered the bytes; orjson parses them
+        # roughly 2x faster than the stdlib decoder behind response.json()
+        return orjson.loads(response.content)
+
+    async def _make_conditional_request(
+            self,
+            endpoint: str,
+            params: Optional[Dict[str, Any]] = None,
+            etag: Optional[str] = None
+    ) -> Tuple[Optional[Dict[str, Any]], Optional[str]]:
+        """
+        Make a request with If-None-Match revalidation.
+
+        Args:
+            endpoint: API endpoint path
+            params: Query parameters
+            etag: ETag from the previous response, if known
+
+        Returns:
+            Tuple of (data, etag). data is None on a 304 - the caller's
+            cached copy is still current and no body was transferred.
+        """
+        headers = self.headers
+        if etag:
+            headers = {**self.headers, "If-None-Match": etag}
+
+        client = await get_shared_client()
+        response = await client.get(
+            f"{self.base_url}{endpoint}",
+            params=params,
+            headers=headers
+        )
+        if response.status_code == 304:
+            return None, etag
+        response.raise_for_status()
+        return orjson.loads(response.content), response.headers.get("etag")
     
     async def get_subway_lines(self) -> List[Dict[str, Any]]:
         """
@@ -67,24 +172,32 @@ class MBTAClient:
             List of subway line objects (Red, Orange, Blue, Green only)
         """
         # Check cache first
-        cached_data = load_from_cache("subway_lines")
+        cached_data = await load_from_cache("subway_lines")
         if cached_data is not None:
             return cached_data
-        
+
+        # Expired or missing: revalidate with If-None-Match, so an
+        # unchanged upstream payload costs a 304 instead of a transfer
+        stale_data, stale_etag = await load_stale_from_cache("subway_lines")
+
         # Get all lines (no filter supported on /lines endpoint)
-        data = await self._make_request("/lines")
+        data, etag = await self._make_conditional_request("/lines", etag=stale_etag)
+        if data is None:
+            # 304 - upstream unchanged, renew the cached entry
+            refresh_cache_entry("subway_lines")
+            return stale_data
         all_lines = data.get("data", [])
-        
+
         # Filter for color-named subway lines only (Red, Orange, Blue, Green)
         subway_line_ids = ["line-Red", "line-Orange", "line-Blue", "line-Green"]
         subway_lines = [
-            line for line in all_lines 
+            line for line in all_lines
             if line.get("id") in subway_line_ids
         ]
-        
+
         # Save to cache
-        save_to_cache("subway_lines", subway_lines)
-        
+        await save_to_cache("subway_lines", subway_lines, etag=etag)
+
         return subway_lines
     
     async def get_routes_for_line(
@@ -93,54 +206,31 @@ class MBTAClient:
     ) -> Dict[str, Any]:
         """
         Get routes for a specific line.
-        The /routes endpoint doesn't support filter[line], so we get all subway routes
-        and filter by line relationship on the backend.
-        
-        For Red Line, also includes Mattapan Trolley routes since it's an extension
-        of the Ashmont branch.
-        
+        The /routes endpoint doesn't support filter[line], so we filter the
+        cached get_all_subway_routes() result in memory - no extra MBTA
+        round-trip per line.
+
+        For Red Line, this includes Mattapan Trolley routes since it's an
+        extension of the Ashmont branch (get_all_subway_routes already
+        remaps them to line-Red).
+
         Args:
             line_id: Line ID (e.g., "line-Red")
-            
+
         Returns:
             Dictionary with 'data' (routes) and 'included' (lines) arrays
         """
-        # Get all subway routes with line relationships included
-        params = {
-            "filter[type]": "0,1",
-            "include": "line"
-        }
-        data = await self._make_request("/routes", params=params)
-        all_routes = data.get("data", [])
-        included_lines = data.get("included", [])
-        
+        data = await self.get_all_subway_routes()
+
         # Filter routes by line_id
         filtered_routes = [
-            route for route in all_routes
-            if route.get("relationships", {}).get("line", {}).get("data", {}).get("id") == line_id
+            route for route in data.get("data", [])
+            if _line_id(route) == line_id
         ]
-        
-        # For Red Line, also include Mattapan Trolley routes (it's an extension of Ashmont branch)
-        if line_id == "line-Red":
-            mattapan_routes = [
-                route for route in all_routes
-                if route.get("relationships", {}).get("line", {}).get("data", {}).get("id") == "line-Mattapan"
-            ]
-            # Update Mattapan routes to reference Red Line instead
-            for route in mattapan_routes:
-                if "relationships" not in route:
-                    route["relationships"] = {}
-                route["relationships"]["line"] = {
-                    "data": {
-                        "id": "line-Red",
-                        "type": "line"
-                    }
-                }
-            filtered_routes.extend(mattapan_routes)
-        
+
         return {
             "data": filtered_routes,
-            "included": included_lines
+            "included": data.get("included", [])
         }
     
     async def get_all_subway_routes(self) -> Dict[str, Any]:
@@ -153,44 +243,42 @@ class MBTAClient:
             Dictionary with 'data' (routes) and 'included' (lines) arrays
         """
         # Check cache first
-        cached_data = load_from_cache("all_subway_routes")
+        cached_data = await load_from_cache("all_subway_routes")
         if cached_data is not None:
             return cached_data
-        
+
+        # Expired or missing: revalidate with If-None-Match
+        stale_data, stale_etag = await load_stale_from_cache("all_subway_routes")
+
         params = {
             "filter[type]": "0,1",
             "include": "line"
         }
-        data = await self._make_request("/routes", params=params)
+        data, etag = await self._make_conditional_request(
+            "/routes", params=params, etag=stale_etag
+        )
+        if data is None:
+            # 304 - upstream unchanged, renew the cached entry
+            refresh_cache_entry("all_subway_routes")
+            return stale_data
         all_routes = data.get("data", [])
         included_lines = data.get("included", [])
         
-        # Include Mattapan Trolley routes as part of Red Line
-        # Find Red Line in included lines
-        red_line = next((line for line in included_lines if line.get("id") == "line-Red"), None)
-        
-        # Get Mattapan routes and associate them with Red Line
-        mattapan_routes = [
-            route for route in all_routes
-            if route.get("relationships", {}).get("line", {}).get("data", {}).get("id") == "line-Mattapan"
-        ]
-        
+        # Partition routes in a single pass - Mattapan Trolley is folded
+        # into Red Line (it's an extension of the Ashmont branch)
+        mattapan_routes = []
+        filtered_routes = []
+        for route in all_routes:
+            if _line_id(route) == "line-Mattapan":
+                mattapan_routes.append(route)
+            else:
+                filtered_routes.append(route)
+
         # Update Mattapan routes to reference Red Line instead
         for route in mattapan_routes:
-            if "relationships" not in route:
-                route["relationships"] = {}
-            route["relationships"]["line"] = {
-                "data": {
-                    "id": "line-Red",
-                    "type": "line"
-                }
-            }
-        
+            route.setdefault("relationships", {})["line"] = _RED_LINE_REL
+
         # Include all routes (Red Line routes + Mattapan routes as Red Line)
-        filtered_routes = [
-            route for route in all_routes
-            if route.get("relationships", {}).get("line", {}).get("data", {}).get("id") != "line-Mattapan"
-        ]
         filtered_routes.extend(mattapan_routes)
         
         # Filter out Mattapan line from included lines (we're using Red Line instead)
@@ -203,10 +291,10 @@ class MBTAClient:
             "data": filtered_routes,
             "included": filtered_included_lines
         }
-        
+
         # Save to cache
-        save_to_cache("all_subway_routes", result)
-        
+        await save_to_cache("all_subway_routes", result, etag=etag)
+
         return result
     
     async def get_stops_for_route(
@@ -246,20 +334,62 @@ class MBTAClient:
         cache_key = f"stops_{'_'.join(sorted(route_ids))}"
         
         # Check cache first
-        cached_data = load_from_cache(cache_key)
+        cached_data = await load_from_cache(cache_key)
         if cached_data is not None:
             return cached_data
-        
+
+        # Expired or missing: revalidate with If-None-Match
+        stale_data, stale_etag = await load_stale_from_cache(cache_key)
+
         route_ids_str = ",".join(route_ids)
         params = {"filter[route]": route_ids_str}
-        data = await self._make_request("/stops", params=params)
+        data, etag = await self._make_conditional_request(
+            "/stops", params=params, etag=stale_etag
+        )
+        if data is None:
+            # 304 - upstream unchanged, renew the cached entry
+            refresh_cache_entry(cache_key)
+            return stale_data
         stops = data.get("data", [])
-        
+
         # Save to cache
-        save_to_cache(cache_key, stops)
-        
+        await save_to_cache(cache_key, stops, etag=etag)
+
         return stops
     
+    async def _get_predictions(
+            self,
+            cache_key: str,
+            params: Dict[str, str]
+    ) -> Dict[str, Any]:
+        """
+        Fetch predictions with a short TTL cache.
+
+        Entries live for PREDICTIONS_CACHE_SECONDS (shorter than the
+        upstream update cadence), and concurrent misses for the same key
+        share one request via a per-key lock.
+        """
+        hit = _predictions_cache.get(cache_key)
+        if hit and time.monotonic() - hit[0] < PREDICTIONS_CACHE_SECONDS:
+            return hit[1]
+
+        lock = _predictions_locks.setdefault(cache_key, asyncio.Lock())
+        async with lock:
+            # Another waiter may have refreshed the entry while we queued
+            hit = _predictions_cache.get(cache_key)
+            if hit and time.monotonic() - hit[0] < PREDICTIONS_CACHE_SECONDS:
+                return hit[1]
+
+            data = await self._make_request("/predictions", params=params)
+            result = {
+                "data": data.get("data", []),
+                "included": data.get("included", [])
+            }
+            now = time.monotonic()
+            _prune_predictions_cache(now)
+            _predictions_cache[cache_key] = (now, result)
+            return result
+
     async def get_predictions_for_route(
             self,
             route_id: str
@@ -267,22 +397,20 @@ class MBTAClient:
         """
         Get predictions for a specific route.
         Includes stop data for matching predictions to stops.
-        
-        NOTE: Predictions are NEVER cached - always fetched fresh from API.
-        
+
+        NOTE: Predictions are cached for only a few seconds (see
+        PREDICTIONS_CACHE_SECONDS) - well under the rate at which the
+        MBTA updates them.
+
         Args:
             route_id: Route ID
-            
+
         Returns:
             Dictionary with 'data' (predictions) and 'included' (stops) arrays
         """
         params = {"filter[route]": route_id, "include": "stop"}
-        data = await self._make_request("/predictions", params=params)
-        return {
-            "data": data.get("data", []),
-            "included": data.get("included", [])
-        }
-    
+        return await self._get_predictions(f"route_{route_id}", params)
+
     async def get_predictions_for_stop(
             self,
             stop_id: str
@@ -290,21 +418,19 @@ class MBTAClient:
         """
         Get predictions for a specific stop.
         Includes stop data for matching.
-        
-        NOTE: Predictions are NEVER cached - always fetched fresh from API.
-        
+
+        NOTE: Predictions are cached for only a few seconds (see
+        PREDICTIONS_CACHE_SECONDS) - well under the rate at which the
+        MBTA updates them.
+
         Args:
             stop_id: Stop ID
-            
+
         Returns:
             Dictionary with 'data' (predictions) and 'included' (stops) arrays
         """
         params = {"filter[stop]": stop_id, "include": "stop,route"}
-        data = await self._make_request("/predictions", params=params)
-        return {
-            "data": data.get("data", []),
-            "included": data.get("included", [])
-        }
+        return await self._get_predictions(f"stop_{stop_id}", params)
     
     async def get_shapes_for_route(
             self,
@@ -314,156 +440,132 @@ class MBTAClient:
         Get shapes (polylines) for a specific route.
         Filters to only include canonical/main route pattern shapes to avoid duplicates.
         Adds route_id to each shape for color mapping.
-        
+
+        Selected shapes are cached per route, so hot single-route hits
+        skip both the network round-trip and the selection logic.
+
         Args:
             route_id: Route ID
-            
+
         Returns:
             List of shape objects with route_id added (filtered to canonical shapes)
         """
+        cache_key = f"shape_{route_id}"
+
+        # Check cache first
+        cached_data = await load_from_cache(cache_key)
+        if cached_data is not None:
+            return cached_data
+
+        # Expired or missing: revalidate with If-None-Match
+        stale_data, stale_etag = await load_stale_from_cache(cache_key)
+
         params = {"filter[route]": route_id}
-        data = await self._make_request("/shapes", params=params)
-        all_shapes = data.get("data", [])
-        
-        # For routes with branches (like Red Line), we need to show all distinct branches
-        # Filter to show main route patterns while preserving branch diversity
-        # For subway routes, we want to show a single representative shape
-        # Strategy: Prefer canonical shapes, then longest shapes, avoiding duplicates
-        
+        data, etag = await self._make_conditional_request(
+            "/shapes", params=params, etag=stale_etag
+        )
+        if data is None:
+            # 304 - upstream unchanged, renew the cached entry
+            refresh_cache_entry(cache_key)
+            return stale_data
+        shapes = self._select_shapes(route_id, data.get("data", []))
+
+        # Save to cache
+        await save_to_cache(cache_key, shapes, etag=etag)
+
+        return shapes
+
+    @staticmethod
+    def _select_shapes(
+            route_id: str,
+            all_shapes: List[Dict[str, Any]]
+    ) -> List[Dict[str, Any]]:
+        """
+        Pick the representative shapes for a route from its raw shape list.
+
+        One pass ranks every shape by (is_canonical, polyline length) and
+        dedups on the shape ID minus any "canonical-" prefix, so a
+        branch's canonical shape wins over its non-canonical twin. One
+        sort then orders canonical-first, longest-first, and the slice
+        rules preserve branch diversity: the Red Line keeps several
+        shapes (Ashmont and Braintree in both directions), other routes
+        keep up to 3 when lengths differ enough to suggest real branches
+        and otherwise just the longest (same branch, different
+        directions).
+
+        Args:
+            route_id: Route ID (added to each shape as _route_id)
+            all_shapes: Raw shape objects from the /shapes endpoint
+
+        Returns:
+            List of shape objects with _route_id added
+        """
         if not all_shapes:
             return []
-        
-        # First, try to find canonical shapes (main route patterns)
-        canonical_shapes = [s for s in all_shapes if s.get("id", "").startswith("canonical-")]
-        
-        # Special handling for Red Line: keep all canonical shapes to preserve branches
+
         is_red_line = route_id == "Red"
-        
-        if canonical_shapes:
-            # Use canonical shapes, but preserve distinct branches
-            # For Red Line, different shape IDs (e.g., canonical-933_0010 vs canonical-933_0009)
-            # represent different branches, so we keep them all
-            # Only remove exact duplicates
-            filtered = []
-            seen_ids = set()
-            for shape in canonical_shapes:
-                shape_id = shape.get("id", "")
-                if shape_id not in seen_ids:
-                    filtered.append(shape)
-                    seen_ids.add(shape_id)
-            canonical_shapes = filtered
-            
-            # For Red Line, if we have canonical shapes, return all of them
-            # This ensures we show both branches (Ashmont and Braintree) in both directions
-            if is_red_line and len(canonical_shapes) >= 2:
-                # Keep all canonical shapes for Red Line - they represent the branches
-                # Add route_id to each shape
-                for shape in canonical_shapes:
-                    if "attributes" not in shape:
-                        shape["attributes"] = {}
-                    shape["attributes"]["_route_id"] = route_id
-                
-                return canonical_shapes
-        
-        # For other routes, if no canonical shapes or too many, filter by longest polyline
-        if (len(canonical_shapes) > 2 and not is_red_line) or not canonical_shapes:
-            # Calculate polyline lengths and sort by length
-            shapes_with_length = []
-            for shape in all_shapes:
-                polyline = shape.get("attributes", {}).get("polyline", "")
-                if polyline:
-                    shapes_with_length.append((len(polyline), shape))
-            
-            if shapes_with_length:
-                # Sort by length (descending) and take the longest ones
-                shapes_with_length.sort(key=lambda x: x[0], reverse=True)
-                
-                # For subway routes, typically want 2 shapes max (one per direction)
-                # But for display, we can show just the longest one
-                if canonical_shapes:
-                    # Merge canonical with longest non-canonical
-                    canonical_ids = {s.get("id") for s in canonical_shapes}
-                    longest_non_canonical = [s for _, s in shapes_with_length if s.get("id") not in canonical_ids]
-                    if longest_non_canonical:
-                        canonical_shapes.append(longest_non_canonical[0])
-                else:
-                    # Use the longest shape(s) - typically 1-2 for subway routes
-                    # Take up to 2 longest shapes (one per direction if they exist)
-                    max_shapes = min(2, len(shapes_with_length))
-                    canonical_shapes = [s for _, s in shapes_with_length[:max_shapes]]
-        
-        # Final deduplication - but preserve distinct branches
-        # For Red Line, we need to keep shapes that represent different branches (Ashmont vs Braintree)
-        # So we use the full shape ID (minus canonical- prefix) for deduplication
-        final_shapes = []
-        seen_ids = set()
-        for shape in canonical_shapes:
+
+        # Single pass: best candidate per dedup key
+        best: Dict[str, Tuple[bool, int, Dict[str, Any]]] = {}
+        for shape in all_shapes:
             shape_id = shape.get("id", "")
-            # For canonical shapes, use the full ID after "canonical-" for deduplication
-            # This preserves different branches (e.g., canonical-933_0010 vs canonical-933_0009)
-            if shape_id.startswith("canonical-"):
-                dedup_id = shape_id.replace("canonical-", "")
-            else:
-                # For non-canonical, use the full ID
-                dedup_id = shape_id
-            if dedup_id not in seen_ids:
-                final_shapes.append(shape)
-                seen_ids.add(dedup_id)
-        
-        canonical_shapes = final_shapes if final_shapes else canonical_shapes
-        
-        # For routes with branches (like Red Line with Ashmont and Braintree),
-        # we need to show multiple shapes representing different branches.
-        # Strategy: Keep multiple canonical shapes if they exist, as they represent
-        # distinct route patterns. Only filter aggressively if we have too many.
-        if len(canonical_shapes) > 1:
-            # Calculate polyline lengths
-            shapes_with_length = []
-            for shape in canonical_shapes:
-                polyline = shape.get("attributes", {}).get("polyline", "")
-                shapes_with_length.append((len(polyline), shape))
-            
-            # Sort by length (descending)
-            shapes_with_length.sort(key=lambda x: x[0], reverse=True)
-            
-            # For subway routes, we typically want to show:
-            # - Up to 2-3 shapes if they represent different branches (Red Line: Ashmont, Braintree)
-            # - Only 1 shape if they're just different directions of the same branch
-            # 
-            # For routes that commonly have branches (like Red Line), be more permissive.
-            # Routes with branches may have shapes of similar length but different paths.
-            lengths = [length for length, _ in shapes_with_length]
-            if len(lengths) >= 2:
-                max_length = lengths[0]
-                min_length = lengths[-1]
-                
-                # Special handling for Red Line which has Ashmont and Braintree branches
-                # For Red Line, keep all shapes (they represent different branches)
-                # For other routes, use length difference to determine if they're different branches
-                if is_red_line:
-                    # Red Line: keep all shapes (up to reasonable limit) to show both branches
-                    canonical_shapes = [s for _, s in shapes_with_length[:5]]
-                else:
-                    # Other routes: check if shapes represent different branches
-                    length_diff_ratio = (max_length - min_length) / max_length if max_length > 0 else 0
-                    if length_diff_ratio >= 0.15:
-                        # Different branches - keep up to 3 longest distinct shapes
-                        canonical_shapes = [s for _, s in shapes_with_length[:3]]
-                    else:
-                        # Similar lengths - likely same branch, different directions
-                        # Keep the longest one (most complete representation)
-                        canonical_shapes = [s for _, s in shapes_with_length[:1]]
+            is_canonical = shape_id.startswith("canonical-")
+            dedup_id = shape_id[len("canonical-"):] if is_canonical else shape_id
+            poly_len = len(shape.get("attributes", {}).get("polyline", ""))
+            candidate = (is_canonical, poly_len, shape)
+            current = best.get(dedup_id)
+            if current is None or candidate[:2] > current[:2]:
+                best[dedup_id] = candidate
+
+        # Single sort: canonical shapes first, then longest first
+        ranked = sorted(best.values(), key=lambda t: (-t[0], -t[1]))
+
+        # Canonical shapes are the curated route patterns: when any
+        # exist they are the only candidates, and non-canonical shapes
+        # (individual trips) serve purely as a fallback - otherwise the
+        # length-ratio rule below can mistake a long trip variant for a
+        # distinct branch and readmit overlapping polylines
+        canonical_count = sum(1 for is_canonical, _, _ in ranked if is_canonical)
+        pool = ranked[:canonical_count] if canonical_count else ranked
+
+        if is_red_line:
+            # Red Line: keep all shapes (up to a reasonable limit) so both
+            # branches show in both directions
+            selected = pool[:5]
+        elif len(pool) >= 2:
+            lengths = [poly_len for _, poly_len, _ in pool]
+            max_length = max(lengths)
+            min_length = min(lengths)
+            length_diff_ratio = (max_length - min_length) / max_length if max_length > 0 else 0
+            if length_diff_ratio >= 0.15:
+                # Different branches - keep up to 3 longest distinct shapes
+                selected = pool[:3]
             else:
-                # Only one shape, keep it
-                canonical_shapes = [s for _, s in shapes_with_length]
-        
-        # Add route_id to each shape for easy lookup
-        for shape in canonical_shapes:
+                # Similar lengths - likely same branch, different directions
+                # Keep the longest one (most complete representation)
+                selected = pool[:1]
+        else:
+            selected = pool
+
+        # Add route_id and the decoded coordinates to each shape
+        shapes = [shape for _, _, shape in selected]
+        for shape in shapes:
             if "attributes" not in shape:
                 shape["attributes"] = {}
-            shape["attributes"]["_route_id"] = route_id
-        
-        return canonical_shapes
+            attributes = shape["attributes"]
+            attributes["_route_id"] = route_id
+            # Decode the Google-encoded polyline once here instead of on
+            # every client, and drop the encoded string: shipping both
+            # would grow the payload, and the frontend reads the
+            # ready-to-use lat/lng pairs from _coords (falling back to
+            # decoding a polyline string only for pre-_coords payloads)
+            encoded = attributes.pop("polyline", None)
+            if encoded and "_coords" not in attributes:
+                attributes["_coords"] = np.asarray(
+                    polyline_codec.decode(encoded), dtype=np.float32
+                )
+
+        return shapes
     
     async def get_all_shapes_for_routes(
             self,
@@ -471,62 +573,62 @@ class MBTAClient:
     ) -> Dict[str, Any]:
         """
         Get all shapes for multiple routes.
-        Fetches shapes for each route individually and filters to main route patterns
-        to avoid showing duplicate/overlapping lines.
-        
+        Fetches shapes for each route in parallel and filters each route
+        to its main patterns to avoid showing duplicate/overlapping lines.
+
+        A single batched /shapes request isn't possible: the MBTA's
+        consolidated-shapes API (the one that introduced the canonical-
+        IDs) dropped the shape->route relationship, so shapes in a
+        multi-route response can't be attributed back to their route.
+        The per-route calls are cached and revalidated individually, so
+        refreshes still avoid full transfers.
+
         Args:
             route_ids: List of route IDs
-            
+
         Returns:
             Dictionary with 'data' (shapes with route_id added, filtered) and route mapping
         """
         if not route_ids:
             return {"data": [], "shape_to_route": {}}
-        
+
         # Create cache key from sorted route IDs
         cache_key = f"shapes_{'_'.join(sorted(route_ids))}"
-        
+
         # Check cache first
-        cached_data = load_from_cache(cache_key)
+        cached_data = await load_from_cache(cache_key)
         if cached_data is not None:
             return cached_data
-        
-        all_shapes = []
-        shape_to_route = {}
-        
-        # Fetch shapes for all routes in parallel for better performance
+
+        # Fetch shapes for all routes in parallel; each call hits its
+        # own per-route cache with If-None-Match revalidation
         shape_tasks = [self.get_shapes_for_route(route_id) for route_id in route_ids]
         shape_results = await asyncio.gather(*shape_tasks, return_exceptions=True)
-        
-        # Process results
+
+        all_shapes = []
+        shape_to_route = {}
         for route_id, filtered_shapes in zip(route_ids, shape_results):
             if isinstance(filtered_shapes, Exception):
                 # Log error but continue with other routes
-                tb = traceback.extract_tb(filtered_shapes.__traceback__) if hasattr(filtered_shapes, '__traceback__') and filtered_shapes.__traceback__ else None
-                line_no = tb[-1].lineno if tb else "unknown"
-                print(f"Exception at line {line_no}: Error fetching shapes for route {route_id}: {filtered_shapes}")
+                logger.error(
+                    "Error fetching shapes for route %s",
+                    route_id,
+                    exc_info=filtered_shapes
+                )
                 continue
-            
-            # Add route_id to each shape (already done by get_shapes_for_route, but ensure it's there)
+            # route_id is already set by _select_shapes; record the mapping
             for shape in filtered_shapes:
-                shape_id = shape.get("id")
-                if "attributes" not in shape:
-                    shape["attributes"] = {}
-                shape["attributes"]["_route_id"] = route_id
-                shape_to_route[shape_id] = route_id
+                shape_to_route[shape.get("id")] = route_id
                 all_shapes.append(shape)
-        
+
         result = {
             "data": all_shapes,
             "shape_to_route": shape_to_route
         }
-        
-        # Create cache key from sorted route IDs
-        cache_key = f"shapes_{'_'.join(sorted(route_ids))}"
-        
+
         # Save to cache
-        save_to_cache(cache_key, result)
-        
+        await save_to_cache(cache_key, result)
+
         return result
     
     async def get_alerts_for_line(
@@ -551,12 +653,17 @@ class MBTAClient:
         }
         data = await self._make_request("/alerts", params=params)
         alerts = data.get("data", [])
-        # Also sort on frontend to ensure proper ordering
-        alerts.sort(
-            key=lambda x: x.get("attributes", {}).get("severity", 0),
-            reverse=True
-        )
-        return alerts
+        # Re-sort locally to guarantee ordering. Decorate-sort-undecorate:
+        # severity is extracted once per alert (short-circuiting instead
+        # of allocating default dicts) and the sort key is a C-level
+        # itemgetter rather than a Python lambda.
+        decorated = []
+        for alert in alerts:
+            attributes = alert.get("attributes")
+            severity = (attributes and attributes.get("severity")) or 0
+            decorated.append((severity, alert))
+        decorated.sort(key=itemgetter(0), reverse=True)
+        return [alert for _, alert in decorated]
     
     async def get_facilities_for_stop(
             self,
@@ -0,0 +1,161 @@
+"""
+In-process response cache for low-volatility endpoints.
+Caches route handler results keyed by handler name + query arguments so
+repeated requests skip the MBTA client (and its disk cache) entirely.
+
+Payloads are stored as already-serialized JSON bytes and served via a raw
+Response, so cache hits skip FastAPI's encode path completely. Each entry
+also carries an ETag so warm browsers get a bodyless 304 Not Modified.
+Large payloads can additionally be spooled to disk and served with
+FileResponse, which uvicorn sends with sendfile(2) on Linux - the body
+never passes through Python at all.
+"""
+import functools
+import hashlib
+import os
+import time
+from pathlib import Path
+from typing import Any, Callable, Dict, Optional, Tuple
+
+import aiofiles
+import orjson
+from fastapi import Request, Response
+from fastapi.responses import FileResponse
+
+from .cache_manager import CACHE_DIR
+
+# Spool directory for file-backed response bodies
+RESPONSE_SPOOL_DIR = CACHE_DIR / "responses"
+RESPONSE_SPOOL_DIR.mkdir(parents=True, exist_ok=True)
+
+# cache_key -> (expiry time from time.monotonic(), response body bytes,
+#               etag, spool file path for file-backed entries or None)
+_response_cache: Dict[str, Tuple[float, bytes, str, Optional[Path]]] = {}
+
+# Keys include client-supplied path/query values (and the MBTA answers
+# unknown IDs with 200 + empty data), so the cache must be bounded or
+# garbage requests pin bodies in RAM forever
+RESPONSE_CACHE_MAX_ENTRIES = 256
+
+
+def _evict_entry(cache_key: str) -> None:
+    """Drop one entry and its spool file, if any."""
+    entry = _response_cache.pop(cache_key, None)
+    if entry is not None and entry[3] is not None:
+        entry[3].unlink(missing_ok=True)
+
+
+def _prune_response_cache(now: float) -> None:
+    """Drop expired entries, then the oldest ones down to the size cap."""
+    for cache_key in [k for k, entry in _response_cache.items() if now >= entry[0]]:
+        _evict_entry(cache_key)
+    # Dicts iterate in insertion order, so the first keys are the oldest
+    while len(_response_cache) >= RESPONSE_CACHE_MAX_ENTRIES:
+        _evict_entry(next(iter(_response_cache)))
+
+
+def build_cache_key(handler_name: str, kwargs: Dict[str, Any]) -> str:
+    """Build a cache key from the handler name and its sorted arguments."""
+    parts = [handler_name]
+    for name in sorted(kwargs):
+        # The Request dependency isn't part of the cache identity
+        if isinstance(kwargs[name], Request):
+            continue
+        parts.append(f"{name}={kwargs[name]}")
+    return "|".join(parts)
+
+
+def _make_etag(body: bytes) -> str:
+    """Build a strong ETag from the response body bytes."""
+    return f'"{hashlib.blake2b(body, digest_size=16).hexdigest()}"'
+
+
+def _spool_path(cache_key: str) -> Path:
+    """Get the spool file path for a cache key (hashed - keys hold query text)."""
+    digest = hashlib.blake2b(cache_key.encode(), digest_size=16).hexdigest()
+    return RESPONSE_SPOOL_DIR / f"{digest}.json"
+
+
+async def _write_spool_file(path: Path, body: bytes) -> None:
+    """Write the response body to its spool file."""
+    # Write to a temp file and rename so an in-flight FileResponse never
+    # reads a half-written body
+    tmp_path = path.with_suffix(".tmp")
+    async with aiofiles.open(tmp_path, 'wb') as f:
+        await f.write(body)
+    os.replace(tmp_path, path)
+
+
+def cache_response(expire: int, file_backed: bool = False) -> Callable:
+    """
+    Decorator that caches a route handler's result for `expire` seconds.
+
+    Apply between @router.get and the handler. The underlying MBTA GTFS
+    data changes at most daily, so low-volatility endpoints can serve
+    from memory without touching the upstream API.
+
+    With file_backed=True the body is also spooled to disk and hits are
+    served with FileResponse, so uvicorn can use kernel-level sendfile
+    instead of copying the body through Python. Use for the big
+    shape/stop payloads.
+
+    NOTE: never apply this to prediction endpoints - predictions must
+    always be fetched fresh.
+    """
+    def decorator(handler: Callable) -> Callable:
+        @functools.wraps(handler)
+        async def wrapper(*args, **kwargs):
+            request = kwargs.get("request")
+            cache_key = build_cache_key(handler.__name__, kwargs)
+            now = time.monotonic()
+            cached = _response_cache.get(cache_key)
+            if cached is not None and now < cached[0]:
+                _, body, etag, spool_file = cached
+                # Warm browser: collapse the full body to a 304
+                if request is not None and request.headers.get("if-none-match") == etag:
+                    return Response(status_code=304, headers={"ETag": etag})
+                if spool_file is not None:
+                    # Zero-copy body transfer via sendfile
+                    return FileResponse(
+                        spool_file,
+                        media_type="application/json",
+                        headers={"ETag": etag}
+                    )
+                return Response(
+                    content=body,
+                    media_type="application/json",
+                    headers={"ETag": etag}
+                )
+
+            result = await handler(*args, **kwargs)
+            if isinstance(result, Response):
+                # Handler already built a response (e.g. an error); don't cache
+                return result
+
+            # Serialize once and cache the final body bytes, so hits skip
+            # the dict -> JSON encode entirely. OPT_SERIALIZE_NUMPY
+            # handles the decoded shape coordinate arrays.
+            body = orjson.dumps(result, option=orjson.OPT_SERIALIZE_NUMPY)
+            etag = _make_etag(body)
+            # Prune before the spool write: an expired entry for this
+            # same key points at the same spool path, and evicting it
+            # afterwards would delete the fresh file
+            _prune_response_cache(now)
+            spool_file = None
+            if file_backed:
+                spool_file = _spool_path(cache_key)
+                await _write_spool_file(spool_file, body)
+            _response_cache[cache_key] = (now + expire, body, etag, spool_file)
+            return Response(
+                content=body,
+                media_type="application/json",
+                headers={"ETag": etag}
+            )
+        return wrapper
+    return decorator
+
+
+def clear_response_cache() -> None:
+    """Clear all cached responses."""
+    for cache_key in list(_response_cache):
+        _evict_entry(cache_key)
@@ -2,14 +2,21 @@
 Map tile caching service.
 Downloads and caches OpenStreetMap tiles to the Data folder.
 """
+import asyncio
+import logging
+import math
 import os
 import json
-import traceback
+import time
 import aiofiles
+import numpy as np
 from pathlib import Path
-from typing import Tuple, Optional
+from typing import List, Optional, Tuple
 import httpx
 from .cache_manager import ensure_cache_dir
+from .http import get_shared_client
+
+logger = logging.getLogger(__name__)
 
 # Boston center coordinates
 BOSTON_CENTER = (42.3601, -71.0589)
@@ -22,32 +29,85 @@ CACHE_ZOOM_LEVELS = [9, 10, 11, 12, 13, 14, 15]
 # Tile cache directory
 TILE_CACHE_DIR = ensure_cache_dir() / "tiles"
 
+# Maximum tiles in flight at once during a preload. The token buckets
+# below do the actual rate limiting; this just bounds open connections.
+MAX_CONCURRENT_DOWNLOADS = 32
+
+# OSM serves tiles from three subdomains; its usage policy asks for a
+# modest request rate, enforced here per subdomain
+TILE_SUBDOMAINS = 3
+TILE_REQUESTS_PER_SECOND = 2.0
+
+
+class TokenBucket:
+    """
+    Async token-bucket rate limiter.
+
+    Tokens refill continuously at `rate` per second up to `capacity`;
+    take() consumes one, sleeping until it's available. Unlike a
+    sleep-between-batches loop this keeps requests flowing at the
+    allowed rate instead of bursting then stalling.
+    """
+
+    def __init__(self, rate: float, capacity: int) -> None:
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = float(capacity)
+        self._updated = time.monotonic()
+        # Serializes takers so waits queue fairly
+        self._lock = asyncio.Lock()
+
+    async def take(self) -> None:
+        """Consume one token, waiting for the refill if none is free."""
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self._tokens = min(
+                    self.capacity,
+                    self._tokens + (now - self._updated) * self.rate
+                )
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+
+
+def lat_lngs_to_tiles(lats, lngs, zooms) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Convert arrays of lat/lng/zoom to slippy-map tile indices.
+
+    One vectorized projection covers every (corner, zoom) combination,
+    replacing per-point Python transcendental calls.
+
+    Returns:
+        Tuple of (xs, ys) int64 arrays
+    """
+    lats = np.asarray(lats, dtype=np.float64)
+    lngs = np.asarray(lngs, dtype=np.float64)
+    zooms = np.asarray(zooms)
+    n = (1 << zooms).astype(np.int64)
+    xs = ((lngs + 180) / 360 * n).astype(np.int64)
+    lat_rad = np.deg2rad(lats)
+    ys = (
+        (1 - np.log(np.tan(lat_rad) + 1 / np.cos(lat_rad)) / np.pi) / 2 * n
+    ).astype(np.int64)
+    return xs, ys
+
 
 def lat_lng_to_tile(lat: float, lng: float, zoom: int) -> Tuple[int, int, int]:
     """
-    Convert lat/lng to tile coordinates.
-    
+    Convert a single lat/lng to slippy-map tile coordinates.
+
     Returns:
         Tuple of (x, y, z)
     """
-    n = 2 ** zoom
-    x = int((lng + 180) / 360 * n)
-    lat_rad = (lat * 3.141592653589793) / 180
-    y = int(((1 - (1 / 3.141592653589793) * 
-              (1 + (1 / 3.141592653589793)) * 
-              (1 - (1 / 3.141592653589793)) * 
-              (1 + (1 / 3.141592653589793))) / 2) * n)
-    
-    # Correct calculation
-    import math
-    y = int((1 - math.log(math.tan(lat_rad) + 1 / math.cos(lat_rad)) / math.pi) / 2 * n)
-    
-    return (x, y, zoom)
+    xs, ys = lat_lngs_to_tiles([lat], [lng], [zoom])
+    return (int(xs[0]), int(ys[0]), zoom)
 
 
 def get_cache_bounds():
     """Calculate bounding box for cache area."""
-    import math
     # 1 degree latitude ≈ 69 miles
     # 1 degree longitude ≈ 69 * cos(latitude) miles
     lat_degrees = CACHE_RADIUS_MILES / 69
@@ -65,56 +125,71 @@ def generate_tile_coordinates():
     """Generate all tile coordinates for the cache area."""
     bounds = get_cache_bounds()
     tiles = []
-    
-    for zoom in CACHE_ZOOM_LEVELS:
-        # Get tile coordinates for all four corners
-        nw_tile = lat_lng_to_tile(bounds["north"], bounds["west"], zoom)
-        ne_tile = lat_lng_to_tile(bounds["north"], bounds["east"], zoom)
-        sw_tile = lat_lng_to_tile(bounds["south"], bounds["west"], zoom)
-        se_tile = lat_lng_to_tile(bounds["south"], bounds["east"], zoom)
-        
-        # Find min/max x and y values
-        min_x = min(nw_tile[0], ne_tile[0], sw_tile[0], se_tile[0])
-        max_x = max(nw_tile[0], ne_tile[0], sw_tile[0], se_tile[0])
-        min_y = min(nw_tile[1], ne_tile[1], sw_tile[1], se_tile[1])
-        max_y = max(nw_tile[1], ne_tile[1], sw_tile[1], se_tile[1])
-        
-        # Generate all tiles in the bounding box
-        for x in range(min_x, max_x + 1):
-            for y in range(min_y, max_y + 1):
-                tiles.append((x, y, zoom))
-    
+
+    # x grows east and y grows south, so the west/north corner gives the
+    # minimum tile indices and east/south the maximum - no need to
+    # project all four corners. Both corners project across every zoom
+    # level in one vectorized call each.
+    zooms = np.asarray(CACHE_ZOOM_LEVELS)
+    min_xs, min_ys = lat_lngs_to_tiles(bounds["north"], bounds["west"], zooms)
+    max_xs, max_ys = lat_lngs_to_tiles(bounds["south"], bounds["east"], zooms)
+
+    for zoom, min_x, min_y, max_x, max_y in zip(
+            CACHE_ZOOM_LEVELS, min_xs, min_ys, max_xs, max_ys):
+        # Materialize the (x, y) grid in NumPy instead of a Python
+        # double loop over thousands of tiles per zoom level
+        xs, ys = np.meshgrid(
+            np.arange(min_x, max_x + 1),
+            np.arange(min_y, max_y + 1),
+            indexing='ij'
+        )
+        tiles.extend(zip(
+            xs.ravel().tolist(),
+            ys.ravel().tolist(),
+            [zoom] * xs.size
+        ))
+
     return tiles
 
 
 def get_tile_path(x: int, y: int, z: int) -> Path:
-    """Get the file path for a cached tile."""
+    """Get the file path for a cached tile. Pure path join, no mkdir."""
     # Organize tiles by zoom level: tiles/z/x/y.png
-    tile_dir = TILE_CACHE_DIR / str(z) / str(x)
-    tile_dir.mkdir(parents=True, exist_ok=True)
-    return tile_dir / f"{y}.png"
+    return TILE_CACHE_DIR / str(z) / str(x) / f"{y}.png"
 
 
-async def download_tile(x: int, y: int, z: int) -> bool:
-    """Download and cache a single tile."""
+async def download_tile(
+        x: int,
+        y: int,
+        z: int,
+        client: httpx.AsyncClient,
+        semaphore: asyncio.Semaphore,
+        buckets: List[TokenBucket]
+) -> bool:
+    """Download and cache a single tile over the shared client."""
     try:
-        subdomain = (x + y) % 3
+        subdomain = (x + y) % TILE_SUBDOMAINS
         url = f"https://{subdomain}.tile.openstreetmap.org/{z}/{x}/{y}.png"
-        
-        async with httpx.AsyncClient(timeout=30.0) as client:
-            response = await client.get(url)
-            response.raise_for_status()
-            
-            # Save tile to cache
-            tile_path = get_tile_path(x, y, z)
-            async with aiofiles.open(tile_path, 'wb') as f:
-                await f.write(response.content)
-            
-            return True
-    except Exception as e:
-        tb = traceback.extract_tb(e.__traceback__)
-        line_no = tb[-1].lineno if tb else "unknown"
-        print(f"Exception at line {line_no}: Error downloading tile {z}/{x}/{y}: {e}")
+
+        tile_path = get_tile_path(x, y, z)
+
+        # Stream the body straight to disk in 64 KiB chunks instead of
+        # buffering the whole PNG and then writing a second copy - at
+        # most one chunk per in-flight tile lives in memory
+        async with semaphore:
+            # Pace requests to this tile's subdomain
+            await buckets[subdomain].take()
+            async with client.stream("GET", url) as response:
+                response.raise_for_status()
+                async with aiofiles.open(tile_path, 'wb') as f:
+                    async for chunk in response.aiter_bytes(65536):
+                        await f.write(chunk)
+
+        return True
+    except Exception:
+        logger.exception("Error downloading tile %s/%s/%s", z, x, y)
+        # Don't leave a truncated tile behind - it would look cached
+        get_tile_path(x, y, z).unlink(missing_ok=True)
         return False
 
 
@@ -129,50 +204,88 @@ def get_cached_tile(x: int, y: int, z: int) -> Optional[Path]:
 async def preload_map_tiles(on_progress=None):
     """Download all tiles for the cache area."""
     try:
-        # Ensure tile cache directory exists
-        TILE_CACHE_DIR.mkdir(parents=True, exist_ok=True)
-        
+        # Ensure tile cache directory exists. The mkdir, the
+        # missing-tile scan and the upfront directory creation are all
+        # blocking filesystem calls over tens of thousands of paths, so
+        # they run in a worker thread - the event loop stays free for
+        # any MBTA requests overlapping the preload.
+        await asyncio.to_thread(TILE_CACHE_DIR.mkdir, parents=True, exist_ok=True)
+
         tiles = generate_tile_coordinates()
         total_tiles = len(tiles)
         downloaded = 0
         failed = 0
-        
-        # Download tiles in batches
-        BATCH_SIZE = 10
-        DELAY_BETWEEN_BATCHES = 0.1  # seconds
-        
-        for i in range(0, len(tiles), BATCH_SIZE):
-            batch = tiles[i:i + BATCH_SIZE]
-            
-            import asyncio
-            results = await asyncio.gather(
-                *[download_tile(x, y, z) for x, y, z in batch],
-                return_exceptions=True
-            )
-            
-            for result in results:
-                if result is True:
-                    downloaded += 1
-                else:
-                    failed += 1
-            
-            # Report progress
-            if on_progress:
-                on_progress({
-                    "downloaded": downloaded,
-                    "failed": failed,
-                    "total": total_tiles,
-                    "percentage": int((downloaded / total_tiles) * 100) if total_tiles > 0 else 0
-                })
-            
-            # Small delay between batches
-            if i + BATCH_SIZE < len(tiles):
-                await asyncio.sleep(DELAY_BETWEEN_BATCHES)
-        
-        print(f"Map tile cache complete: {downloaded}/{total_tiles} tiles downloaded")
-        return {"downloaded": downloaded, "failed": failed, "total": total_tiles}
-    except Exception as e:
-        tb = traceback.extract_tb(e.__traceback__)
-        line_no = tb[-1].lineno if tb else "unknown"
-        print(f"Exception at line {line_no}: Error preloading map tiles: {e}")
-        return {"downloaded": 0, "failed": 0, "total": 0}
+
+        # Only schedule tiles that aren't on disk yet - re-runs of the
+        # preload then cost zero network round-trips for warm tiles
+        def scan_missing():
+            return [
+                (x, y, z) for (x, y, z) in tiles
+                if not get_tile_path(x, y, z).exists()
+            ]
+
+        missing = await asyncio.to_thread(scan_missing)
+        cached = total_tiles - len(missing)
+
+        # Create every (z, x) tile column directory upfront - one mkdir
+        # per directory instead of a stat/mkdir per tile write
+        def make_tile_dirs():
+            for z, x in {(z, x) for (x, y, z) in missing}:
+                (TILE_CACHE_DIR / str(z) / str(x)).mkdir(parents=True, exist_ok=True)
+
+        await asyncio.to_thread(make_tile_dirs)
+
+        # The process-wide pooled client plus a semaphore bounds open
+        # connections; one token bucket per OSM subdomain paces the
+        # request rate continuously, so tiles fetch at the maximum
+        # allowed rate instead of bursting then stalling
+        semaphore = asyncio.Semaphore(MAX_CONCURRENT_DOWNLOADS)
+        buckets = [
+            TokenBucket(TILE_REQUESTS_PER_SECOND, MAX_CONCURRENT_DOWNLOADS)
+            for _ in range(TILE_SUBDOMAINS)
+        ]
+        client = await get_shared_client()
+        tasks = [
+            asyncio.create_task(download_tile(x, y, z, client, semaphore, buckets))
+            for x, y, z in missing
+        ]
+
+        def progress_report():
+            # Tiles already on disk count as complete
+            completed = cached + downloaded
+            return {
+                "downloaded": downloaded,
+                "cached": cached,
+                "failed": failed,
+                "total": total_tiles,
+                "percentage": int((completed / total_tiles) * 100) if total_tiles > 0 else 0
+            }
+
+        # Consume results as they finish instead of gathering the whole
+        # batch - a slow tile no longer holds up progress reporting, and
+        # the UI gets smooth incremental updates
+        for future in asyncio.as_completed(tasks):
+            if await future:
+                downloaded += 1
+            else:
+                failed += 1
+            if on_progress and (downloaded + failed) % 16 == 0:
+                on_progress(progress_report())
+
+        # Final report covers the remainder
+        if on_progress:
+            on_progress(progress_report())
+
+        logger.info(
+            "Map tile cache complete: %s/%s tiles downloaded (%s already cached)",
+            downloaded, total_tiles, cached
+        )
+        return {
+            "downloaded": downloaded,
+            "cached": cached,
+            "failed": failed,
+            "total": total_tiles
+        }
+    except Exception:
+        logger.exception("Error preloading map tiles")
+        return {"downloaded": 0, "cached": 0, "failed": 0, "total": 0}
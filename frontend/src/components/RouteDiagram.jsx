@@ -22,14 +22,18 @@ const RouteDiagram = ({ lines, routes, stops, shapes }) => {
     return shapes.map((shape) => {
       if (!shape || !shape.id) return null
       
-      const polyline = shape.attributes?.polyline
-      if (typeof polyline !== 'string' || !polyline) return null
-      
-      const coordinates = decodePolyline(polyline)
+      // Prefer coordinates decoded by the backend (_coords); fall back
+      // to decoding an encoded polyline for older payloads
+      let coordinates = shape.attributes?._coords
+      if (!Array.isArray(coordinates) || coordinates.length === 0) {
+        const polyline = shape.attributes?.polyline
+        if (typeof polyline !== 'string' || !polyline) return null
+        coordinates = decodePolyline(polyline)
+      }
       if (!Array.isArray(coordinates) || coordinates.length === 0) return null
-      
+
       const routeId = shape.attributes?._route_id ||
-                     shape.relationships?.route?.data?.id || 
+                     shape.relationships?.route?.data?.id ||
                      shape.attributes?.route_id ||
                      shape.attributes?.route?.id
       